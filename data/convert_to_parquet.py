@@ -5,172 +5,292 @@ Optimized for large files with chunked processing - never loads entire file into
 """
 
 import os
-import pandas as pd
+import time
 import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
 import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
+# Use jemalloc for Arrow buffers where the wheel ships it; it fragments less than glibc malloc
+try:
+    pa.set_memory_pool(pa.jemalloc_memory_pool())
+except NotImplementedError:
+    pass
+
 MAX_SIZE_MB = 50
 MAX_SIZE_BYTES = MAX_SIZE_MB * 1024 * 1024
-CHUNK_SIZE = 100000  # Process 100k rows at a time
+BLOCK_SIZE = 16 << 20  # Read 16MB of CSV per Arrow record batch
+ROW_GROUP_BYTES = 64 << 20  # Buffer ~64MB of Arrow data per Parquet row group
+PROGRESS_INTERVAL = 5.0  # Seconds between progress updates
+
+# Shared CSV parsing settings; keep HH:MM times as text instead of inferring time32
+CSV_CONVERT_OPTIONS = pv.ConvertOptions(column_types={'time': pa.string()}, strings_can_be_null=True)
+
+# Shared ParquetWriter settings
+WRITER_OPTIONS = {
+    'compression': 'zstd',
+    'compression_level': 1,
+    'use_dictionary': True,
+    'write_batch_size': 16384,
+    'data_page_size': 1 << 20,
+}
 
 def get_file_size_mb(filepath):
     """Get file size in MB"""
     return os.path.getsize(filepath) / (1024 * 1024)
 
-def convert_large_csv_chunked(csv_path, output_dir, year_filter=None):
-    """Convert large CSV to Parquet using chunked processing, writing directly to split files"""
-    csv_file = Path(csv_path)
-    output_path = Path(output_dir)
-    output_path.mkdir(parents=True, exist_ok=True)
-    
-    base_name = csv_file.stem
-    print(f"\nProcessing: {csv_file.name}")
-    if year_filter:
-        print(f"  Filtering data from {year_filter[0]} to {year_filter[1]}")
-    print(f"  Determining schema from first chunk...")
-    
-    # Read first chunk to establish schema
-    first_chunk = pd.read_csv(csv_path, nrows=CHUNK_SIZE, low_memory=False)
-    master_schema = pa.Table.from_pandas(first_chunk).schema
-    print(f"  Schema established with {len(master_schema)} columns")
-    print(f"  Processing in chunks and writing to split files...")
+def open_part_writer(output_path, base_name, part_num, schema):
+    """Open a Parquet writer for the given part number on an explicit output stream"""
+    part_file = output_path / f"{base_name}_part{part_num:02d}.parquet"
+    handle = pa.OSFile(str(part_file), 'wb')
+    writer = pq.ParquetWriter(handle, schema, **WRITER_OPTIONS)
+    return part_file, handle, writer
+
+def write_parquet_parts(batches, schema, output_path, base_name, single_file=False):
+    """Write record batches to Parquet parts, starting a new part before MAX_SIZE_MB is reached
     
+    If single_file is True and everything fits in one part, it is named <base_name>.parquet
+    """
     output_files = []
     part_num = 1
     current_writer = None
+    current_handle = None
     current_file = None
     current_size = 0
     total_rows = 0
-    filtered_rows = 0
     rows_in_current_part = 0
+    buffered_batches = []
+    buffered_bytes = 0
+    last_report_time = time.monotonic()
     
     try:
-        for chunk_num, chunk in enumerate(pd.read_csv(csv_path, chunksize=CHUNK_SIZE, low_memory=False, dtype=str), 1):
-            # Apply year filter if specified
-            if year_filter and 'collision_year' in chunk.columns:
-                chunk['collision_year'] = pd.to_numeric(chunk['collision_year'], errors='coerce')
-                original_len = len(chunk)
-                chunk = chunk[(chunk['collision_year'] >= year_filter[0]) & 
-                             (chunk['collision_year'] <= year_filter[1])]
-                filtered_rows += (original_len - len(chunk))
-                
-                # Skip empty chunks
-                if len(chunk) == 0:
-                    continue
+        for batch in batches:
+            total_rows += batch.num_rows
             
-            # Convert string columns back to appropriate types based on master schema
-            for i, field in enumerate(master_schema):
-                col_name = field.name
-                if col_name in chunk.columns:
-                    # Convert based on the master schema type
-                    if pa.types.is_integer(field.type):
-                        chunk[col_name] = pd.to_numeric(chunk[col_name], errors='coerce').astype('Int64')
-                    elif pa.types.is_floating(field.type):
-                        chunk[col_name] = pd.to_numeric(chunk[col_name], errors='coerce')
-                    # String types stay as-is
+            # Buffer batches until there is enough data for a full row group
+            buffered_batches.append(batch)
+            buffered_bytes += batch.nbytes
             
-            total_rows += len(chunk)
-            
-            # Create new file if needed
-            if current_writer is None:
-                current_file = output_path / f"{base_name}_part{part_num:02d}.parquet"
-                current_writer = pq.ParquetWriter(current_file, master_schema, compression='snappy')
-                rows_in_current_part = 0
-            
-            # Write chunk to current file using master schema
-            arrow_table = pa.Table.from_pandas(chunk, schema=master_schema)
-            current_writer.write_table(arrow_table)
-            rows_in_current_part += len(chunk)
-            
-            # Check if we should close this file and start a new one
-            if current_file.exists():
-                current_size = get_file_size_mb(current_file)
+            if buffered_bytes >= ROW_GROUP_BYTES:
+                # Create new file if needed
+                if current_writer is None:
+                    current_file, current_handle, current_writer = open_part_writer(
+                        output_path, base_name, part_num, schema)
+                    rows_in_current_part = 0
+                
+                # Write buffered batches to current file as a single row group
+                row_group = pa.Table.from_batches(buffered_batches, schema=schema)
+                group_start = current_handle.tell()
+                current_writer.write_table(row_group)
+                rows_in_current_part += row_group.num_rows
+                buffered_batches = []
+                buffered_bytes = 0
                 
-                # Close current file if it's approaching the size limit
-                if current_size >= MAX_SIZE_MB * 0.9:  # 90% of max size
+                # Bytes written so far, tracked on the output stream (no stat per chunk)
+                current_size = current_handle.tell()
+                group_size = current_size - group_start
+                
+                # Close current file if another row group would take it past the size limit
+                if current_size + group_size >= MAX_SIZE_BYTES * 0.9:  # 90% of max size
                     current_writer.close()
+                    current_handle.close()
                     final_size = get_file_size_mb(current_file)
                     print(f"    Part {part_num}: {rows_in_current_part:,} rows, {final_size:.2f} MB -> {current_file.name}")
                     output_files.append(str(current_file))
                     
                     part_num += 1
                     current_writer = None
+                    current_handle = None
                     current_file = None
             
-            # Progress update
-            if chunk_num % 10 == 0:
+            # Progress update, at most once per PROGRESS_INTERVAL seconds
+            if time.monotonic() - last_report_time > PROGRESS_INTERVAL:
                 print(f"    Processed {total_rows:,} rows...")
+                last_report_time = time.monotonic()
+        
+        # Write any remaining buffered batches
+        if buffered_batches:
+            if current_writer is None:
+                current_file, current_handle, current_writer = open_part_writer(
+                    output_path, base_name, part_num, schema)
+                rows_in_current_part = 0
+            
+            row_group = pa.Table.from_batches(buffered_batches, schema=schema)
+            current_writer.write_table(row_group)
+            rows_in_current_part += row_group.num_rows
         
         # Close the last file
         if current_writer is not None:
             current_writer.close()
+            current_handle.close()
+            
+            # Everything fit in one part, so drop the part suffix
+            if single_file and part_num == 1:
+                current_file = current_file.rename(output_path / f"{base_name}.parquet")
+            
             final_size = get_file_size_mb(current_file)
             print(f"    Part {part_num}: {rows_in_current_part:,} rows, {final_size:.2f} MB -> {current_file.name}")
             output_files.append(str(current_file))
         
-        print(f"  Total rows processed: {total_rows:,}")
-        if year_filter and filtered_rows > 0:
-            print(f"  Rows filtered out: {filtered_rows:,}")
-        print(f"  ✓ Saved as {len(output_files)} file(s)")
-        
-        return output_files
+        return output_files, total_rows
         
     except Exception as e:
         # Clean up on error
         if current_writer is not None:
             current_writer.close()
+            current_handle.close()
         raise e
 
-def convert_small_csv(csv_path, output_dir):
-    """Convert small CSV files (< 500MB) normally"""
+def probe_schema(csv_path):
+    """Infer the chunked master schema from the first CSV block
+    
+    Only integer and float types are kept from the probe. Columns that are blank so far
+    become float64, as a pandas probe would type them, and everything else is text
+    """
+    probe = pv.open_csv(
+        csv_path,
+        read_options=pv.ReadOptions(block_size=BLOCK_SIZE),
+        convert_options=CSV_CONVERT_OPTIONS
+    )
+    fields = []
+    for field in probe.schema:
+        if pa.types.is_null(field.type):
+            field = field.with_type(pa.float64())
+        elif not (pa.types.is_integer(field.type) or pa.types.is_floating(field.type)):
+            field = field.with_type(pa.string())
+        fields.append(field)
+    probe.close()
+    return pa.schema(fields)
+
+def parse_text_value(value, arrow_type):
+    """Parse a single text value into arrow_type, or None if it does not fit"""
+    try:
+        return pa.scalar(value, pa.string()).cast(arrow_type).as_py()
+    except pa.ArrowInvalid:
+        return None
+
+def cast_text_column(column, arrow_type):
+    """Cast a text column to arrow_type, returning it with the count of values that did not fit and became null"""
+    try:
+        return pc.cast(column, arrow_type), 0
+    except pa.ArrowInvalid:
+        # Some values drifted from the probed type; parse each distinct value on its own
+        # and null out the ones Arrow rejects, instead of failing the file
+        encoded = column.dictionary_encode()
+        parsed = pa.array([parse_text_value(value, arrow_type) for value in encoded.dictionary.to_pylist()],
+                          type=arrow_type)
+        result = pc.take(parsed, encoded.indices)
+        return result, result.null_count - column.null_count
+
+def coerce_batch(batch, schema):
+    """Cast a text-typed batch to the master schema, returning it with the count of values coerced to null
+    
+    Values that do not parse as their column's numeric type become null, like pd.to_numeric(errors='coerce')
+    """
+    columns = []
+    coerced = 0
+    for field, column in zip(schema, batch.columns):
+        if not pa.types.is_string(field.type):
+            column, column_coerced = cast_text_column(column, field.type)
+            coerced += column_coerced
+        columns.append(column)
+    return pa.RecordBatch.from_arrays(columns, schema=schema), coerced
+
+def convert_large_csv_chunked(csv_path, output_dir, year_filter=None):
+    """Convert large CSV to Parquet using chunked processing, writing directly to split files"""
     csv_file = Path(csv_path)
     output_path = Path(output_dir)
     output_path.mkdir(parents=True, exist_ok=True)
     
     base_name = csv_file.stem
     print(f"\nProcessing: {csv_file.name}")
-    print(f"  Reading CSV...")
+    if year_filter:
+        print(f"  Filtering data from {year_filter[0]} to {year_filter[1]}")
+    print(f"  Determining schema from first chunk...")
     
-    df = pd.read_csv(csv_path, low_memory=False)
-    print(f"  Rows: {len(df):,}")
-    print(f"  Columns: {len(df.columns)}")
+    # Probe the first block for column types, then stream every block as text and cast it
+    # to that schema, so a column that drifts later in the file cannot abort the conversion
+    master_schema = probe_schema(csv_path)
+    print(f"  Schema established with {len(master_schema)} columns")
+    print(f"  Processing in chunks and writing to split files...")
     
-    temp_parquet = output_path / f"{base_name}.parquet"
-    df.to_parquet(temp_parquet, index=False, engine='pyarrow', compression='snappy')
+    reader = pv.open_csv(
+        csv_path,
+        read_options=pv.ReadOptions(block_size=BLOCK_SIZE),
+        convert_options=pv.ConvertOptions(
+            column_types={name: pa.string() for name in master_schema.names},
+            strings_can_be_null=True
+        )
+    )
     
-    file_size_mb = get_file_size_mb(temp_parquet)
-    print(f"  Parquet size: {file_size_mb:.2f} MB")
+    filtered_rows = 0
+    coerced_values = 0
     
-    if file_size_mb <= MAX_SIZE_MB:
-        print(f"  ✓ Saved as single file: {temp_parquet.name}")
-        return [str(temp_parquet)]
+    def typed_batches(batches):
+        nonlocal filtered_rows, coerced_values
+        for batch in batches:
+            # Apply year filter if specified, casting only the year column so dropped rows are never parsed
+            if year_filter and 'collision_year' in master_schema.names:
+                yr, _ = cast_text_column(batch['collision_year'], pa.int32())
+                mask = pc.and_(pc.greater_equal(yr, year_filter[0]),
+                               pc.less_equal(yr, year_filter[1]))
+                original_len = batch.num_rows
+                batch = batch.filter(mask)
+                filtered_rows += (original_len - batch.num_rows)
+                
+                # Skip empty chunks
+                if batch.num_rows == 0:
+                    continue
+            
+            batch, coerced = coerce_batch(batch, master_schema)
+            coerced_values += coerced
+            yield batch
     
-    # File is too large, need to split
-    print(f"  File exceeds {MAX_SIZE_MB}MB, splitting...")
-    os.remove(temp_parquet)
+    output_files, total_rows = write_parquet_parts(typed_batches(reader), master_schema, output_path, base_name)
     
-    num_splits = int(file_size_mb / MAX_SIZE_MB) + 1
-    rows_per_split = len(df) // num_splits + 1
+    print(f"  Total rows processed: {total_rows:,}")
+    if year_filter and filtered_rows > 0:
+        print(f"  Rows filtered out: {filtered_rows:,}")
+    if coerced_values > 0:
+        print(f"  Values that did not fit their column type (set to null): {coerced_values:,}")
+    print(f"  ✓ Saved as {len(output_files)} file(s)")
     
-    output_files = []
-    for i in range(num_splits):
-        start_idx = i * rows_per_split
-        end_idx = min((i + 1) * rows_per_split, len(df))
-        
-        if start_idx >= len(df):
-            break
-        
-        chunk = df.iloc[start_idx:end_idx]
-        output_file = output_path / f"{base_name}_part{i+1:02d}.parquet"
-        chunk.to_parquet(output_file, index=False, engine='pyarrow', compression='snappy')
-        
-        chunk_size_mb = get_file_size_mb(output_file)
-        print(f"    Part {i+1}/{num_splits}: {len(chunk):,} rows, {chunk_size_mb:.2f} MB -> {output_file.name}")
-        output_files.append(str(output_file))
+    return output_files
+
+def convert_small_csv(csv_path, output_dir):
+    """Convert small CSV files (< 500MB) normally"""
+    csv_file = Path(csv_path)
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
     
+    base_name = csv_file.stem
+    print(f"\nProcessing: {csv_file.name}")
+    print(f"  Reading CSV...")
+    
+    # Parse straight into Arrow rather than object-backed pandas columns
+    table = pv.read_csv(csv_path, convert_options=CSV_CONVERT_OPTIONS)
+    print(f"  Rows: {table.num_rows:,}")
+    print(f"  Columns: {table.num_columns}")
+    
+    # Stream the table through the same size-capped writer as the chunked path
+    batches = table.to_batches(max_chunksize=50000)
+    output_files, _ = write_parquet_parts(batches, table.schema, output_path, base_name, single_file=True)
+    
+    print(f"  ✓ Saved as {len(output_files)} file(s)")
     return output_files
 
+def _convert_one(csv_path, output_dir, year_filter):
+    """Convert a single CSV, picking the chunked path for files over 500MB"""
+    # Check file size to determine processing method
+    file_size_mb = os.path.getsize(csv_path) / (1024 * 1024)
+    print(f"\n{Path(csv_path).name}: CSV file size {file_size_mb:.2f} MB")
+    
+    if file_size_mb > 500:  # Use chunked processing for files > 500MB
+        return convert_large_csv_chunked(csv_path, output_dir, year_filter)
+    return convert_small_csv(csv_path, output_dir)
+
 def main():
     """Main conversion process"""
     print("=" * 60)
@@ -193,34 +313,31 @@ def main():
     
     all_output_files = []
     
-    for category, files in csv_files.items():
-        print(f"\n{'='*60}")
-        print(f"Category: {category}")
-        print(f"{'='*60}")
-        
-        output_dir = f"data/parquet/{category}"
-        
-        # Set year filter for 2024_prior data
-        year_filter = (2015, 2024) if category == '2024_prior' else None
-        
-        for csv_file in files:
-            if not os.path.exists(csv_file):
-                print(f"\n⚠ Warning: {csv_file} not found, skipping...")
-                continue
+    # Files are independent, so convert them in parallel worker processes
+    with ProcessPoolExecutor(max_workers=min(6, os.cpu_count() or 1)) as executor:
+        futures = {}
+        for category, files in csv_files.items():
+            output_dir = f"data/parquet/{category}"
             
-            try:
-                # Check file size to determine processing method
-                file_size_mb = os.path.getsize(csv_file) / (1024 * 1024)
-                print(f"  CSV file size: {file_size_mb:.2f} MB")
-                
-                if file_size_mb > 500:  # Use chunked processing for files > 500MB
-                    output_files = convert_large_csv_chunked(csv_file, output_dir, year_filter)
-                else:
-                    output_files = convert_small_csv(csv_file, output_dir)
+            # Set year filter for 2024_prior data
+            year_filter = (2015, 2024) if category == '2024_prior' else None
+            
+            for csv_file in files:
+                if not os.path.exists(csv_file):
+                    print(f"\n⚠ Warning: {csv_file} not found, skipping...")
+                    continue
                 
+                future = executor.submit(_convert_one, csv_file, output_dir, year_filter)
+                futures[future] = csv_file
+        
+        for done, future in enumerate(as_completed(futures), 1):
+            csv_file = futures[future]
+            try:
+                output_files = future.result()
                 all_output_files.extend(output_files)
+                print(f"\n[{done}/{len(futures)}] ✓ Finished {csv_file}")
             except Exception as e:
-                print(f"  ✗ Error converting {csv_file}: {str(e)}")
+                print(f"\n[{done}/{len(futures)}] ✗ Error converting {csv_file}: {str(e)}")
                 import traceback
                 traceback.print_exc()
     
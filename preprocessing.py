@@ -1,11 +1,24 @@
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 from calendar import day_name
-from utilites import *
+from glob import glob
+from utilities import *
+from data.convert_to_parquet import convert_small_csv
 
-# Load datasets
-accidents = pd.read_csv('data/accident-data.csv')
-accidents_lookups = pd.read_csv('data/road-safety-lookups.csv')
+# Convert source CSVs to Parquet once; a CSV may have been written as a single file or as parts
+parquet_files = {}
+for dataset in ['accident-data', 'road-safety-lookups']:
+    parquet_files[dataset] = sorted(glob(f'data/{dataset}.parquet') + glob(f'data/{dataset}_part*.parquet'))
+    if not parquet_files[dataset]:
+        parquet_files[dataset] = convert_small_csv(f'data/{dataset}.csv', 'data')
+
+# Load lookups
+accidents_lookups = pq.read_table(parquet_files['road-safety-lookups']).to_pandas(
+    split_blocks=True, self_destruct=True, types_mapper=pd.ArrowDtype
+)
 
 # FIll labels for each field names
 field_names = ['urban_or_rural_area', 'carriageway_hazards', 'special_conditions_at_site', 'road_surface_conditions',
@@ -13,24 +26,40 @@ field_names = ['urban_or_rural_area', 'carriageway_hazards', 'special_conditions
                'second_road_class', 'junction_control', 'road_type', 'first_road_class', 'junction_detail',
                'day_of_week', 'accident_severity']
 
-# Loops through fields and replaces with correct labals
+# Build code -> label lookups for every field in one pass
+label_index = build_label_index(accidents_lookups)
 for field in field_names:
-    field_labels = get_labels_easy(accidents_lookups, field)
-    if 0 in field_labels.keys() and isinstance(field_labels[0], float):
+    field_labels = label_index[field]
+    if 0 in field_labels.keys() and pd.isna(field_labels[0]):
         field_labels[0] = 'None'
-    accidents[field] = accidents[field].replace(field_labels)
+label_arrays = build_label_arrays(label_index, field_names)
 
-# Create timestamp column
-accidents['timestamp'] = pd.to_datetime(
-    accidents['date'] + ' ' + accidents['time']
-    , format='mixed'
+# Stream accidents in record batches, replacing codes with dictionary-encoded labels
+scanner = ds.dataset(parquet_files['accident-data'], format='parquet').scanner()
+labelled = pa.Table.from_batches(label_batch(batch, label_arrays) for batch in scanner.to_batches())
+accidents = labelled.to_pandas(
+    split_blocks=True, self_destruct=True,
+    types_mapper=lambda t: None if pa.types.is_dictionary(t) else pd.ArrowDtype(t)
 )
+del labelled
+
+# Create timestamp column, parsing date and time separately with fixed formats
+dates = pd.to_datetime(accidents['date'], format='%d/%m/%Y')
+times = pd.to_timedelta(accidents['time'] + ':00')
+accidents['timestamp'] = dates + times
 
-# Drop duplicates if any
-accidents.drop_duplicates(inplace=True)
+# Drop duplicates if any; accident_index uniquely identifies an accident, so only that column is hashed.
+# Rows sharing an index must be full duplicates, otherwise real records would be dropped silently
+dup = accidents.duplicated(subset=['accident_index'])
+if dup.any():
+    shared_index = accidents[accidents['accident_index'].isin(accidents.loc[dup, 'accident_index'])]
+    if shared_index.duplicated(subset=['accident_index']).sum() != shared_index.duplicated().sum():
+        raise ValueError('accident_index is shared by rows that differ in other columns')
+accidents = accidents[~dup]
 
 # Print dataset info
 accidents.info()
 
 # Save dataset
-accidents.to_csv('data/accidents_cleaned.csv', index=False)
\ No newline at end of file
+accidents.to_parquet('data/accidents_cleaned.parquet', index=False, engine='pyarrow',
+                     compression='zstd', compression_level=1, row_group_size=200_000)
\ No newline at end of file
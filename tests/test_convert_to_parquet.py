@@ -0,0 +1,29 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from data import convert_to_parquet
+
+
+def test_drifting_columns_do_not_abort_chunked_conversion(tmp_path, monkeypatch):
+    # Small blocks so the probe only sees the early rows
+    monkeypatch.setattr(convert_to_parquet, 'BLOCK_SIZE', 1 << 12)
+
+    rows = ['collision_year,later_filled,district,time']
+    rows += ['2016,,-1,09:00' for _ in range(500)]
+    # Later district values Arrow cannot cast to int64: text, a leading '+', and an int64 overflow
+    rows += [f'2020,0.5,{district},13:55'
+             for _ in range(167) for district in ['E01000001', '+5', '99999999999999999999']][:500]
+    csv_path = tmp_path / 'collision.csv'
+    csv_path.write_text('\n'.join(rows) + '\n')
+
+    output_files = convert_to_parquet.convert_large_csv_chunked(csv_path, tmp_path / 'out', (2015, 2024))
+    table = pa.concat_tables([pq.read_table(f) for f in output_files])
+
+    assert table.num_rows == 1000
+    # Blank in the probe, filled later: typed as float64 and values kept
+    assert table.schema.field('later_filled').type == pa.float64()
+    assert table['later_filled'].to_pylist()[-1] == 0.5
+    # Integer in the probe, text later: values that do not fit become null
+    assert table.schema.field('district').type == pa.int64()
+    assert table['district'].null_count == 500
+    assert table['time'].to_pylist()[:1] == ['09:00']
@@ -0,0 +1,43 @@
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+def build_label_index(dataframe):
+    """
+            Utility function to build a label lookup for every field in a single pass
+    :param dataframe:
+    :return: dict of field name -> {code: label}
+    """
+    codes = dataframe.iloc[:, 2]
+    lookups = dataframe[codes.str.fullmatch(r'-?\d+', na=False)]
+    return {field_name: dict(zip(labels.iloc[:, 2].astype(int), labels.iloc[:, 3]))
+            for field_name, labels in lookups.groupby('field name', sort=False)}
+
+
+def build_label_arrays(label_index, field_names):
+    """
+            Utility function to turn label lookups into Arrow code and label arrays
+    :param label_index: output of build_label_index
+    :param field_names:
+    :return: dict of field name -> (codes, labels)
+    """
+    return {field_name: (pa.array(list(label_index[field_name].keys()), pa.int64()),
+                         pa.array(list(label_index[field_name].values()), pa.string(), from_pandas=True))
+            for field_name in field_names}
+
+
+def label_batch(batch, label_arrays):
+    """
+            Utility function to replace coded columns of a record batch with dictionary-encoded labels
+    :param batch:
+    :param label_arrays: output of build_label_arrays
+    :return: record batch with labelled columns
+    """
+    columns = []
+    for field_name, column in zip(batch.schema.names, batch.columns):
+        if field_name in label_arrays:
+            codes, labels = label_arrays[field_name]
+            # Gather labels, then encode: repeated or blank labels must not end up in the dictionary
+            column = pc.take(labels, pc.index_in(column, value_set=codes)).dictionary_encode()
+        columns.append(column)
+    return pa.RecordBatch.from_arrays(columns, names=batch.schema.names)